@@ -4,8 +4,10 @@ __all__ = [
     "max_projection",
     "compute_thresholds",
     "make_masks",
+    "cytoplasm_mask",
+    "mask_bbox",
     "measure_intensity",
     "partition_coefficient",
 ]
 from .io import load_czi, max_projection
-from .pipeline import compute_thresholds, make_masks, measure_intensity, partition_coefficient
+from .pipeline import compute_thresholds, make_masks, cytoplasm_mask, mask_bbox, measure_intensity, partition_coefficient
@@ -0,0 +1,186 @@
+
+from __future__ import annotations
+import numpy as np
+from numba import njit, prange
+
+# All Numba kernels live in this one module. Numba's on-disk cache is keyed on
+# the source file of the cached function only, so a cached kernel that called
+# into another module would keep running stale code after that module changed.
+
+# Every fastmath flag except 'nnan'/'ninf', so NaN/inf pixels keep their meaning.
+_FASTMATH = {"nsz", "arcp", "contract", "afn", "reassoc"}
+
+@njit(parallel=True, fastmath=_FASTMATH, cache=True)
+def _moments(img):
+    """Return (sum, sum of squares) of a 2D image in one pass, accumulated in float64."""
+    h, w = img.shape
+    s = 0.0
+    s2 = 0.0
+    for i in prange(h):
+        for j in range(w):
+            v = np.float64(img[i, j])
+            s += v
+            s2 += v * v
+    return s, s2
+
+@njit(fastmath=_FASTMATH, cache=True)
+def _thresholds_from_moments(s, s2, n, lower_k, upper_k):
+    mean = s / n
+    std = np.sqrt(max(s2 / n - mean * mean, 0.0))
+    return mean + lower_k * std, mean + upper_k * std
+
+@njit(parallel=True, cache=True)
+def _fill_masks(img, lower, upper, bg_out, agg_out):
+    h, w = img.shape
+    for i in prange(h):
+        for j in range(w):
+            v = img[i, j]
+            bg_out[i, j] = v > lower
+            agg_out[i, j] = v > upper
+
+@njit(fastmath=_FASTMATH, cache=True)
+def _thresh_and_mask(img, lower_k, upper_k, bg_out, agg_out):
+    """Threshold a 2D image into preallocated bool masks; return (lower, upper).
+
+    One reduction pass for sum/sum-of-squares, one pass writing both masks.
+    """
+    h, w = img.shape
+    s, s2 = _moments(img)
+    lower, upper = _thresholds_from_moments(s, s2, h * w, lower_k, upper_k)
+    _fill_masks(img, lower, upper, bg_out, agg_out)
+    return lower, upper
+
+@njit(parallel=True, fastmath=_FASTMATH, cache=True)
+def _all_means(main, red, bg, agg):
+    """Return the five stage means of finite pixels from one pass over the images.
+
+    Order: (main, main on bg, main on agg, red on agg, red on bg & ~agg);
+    a region with no finite pixels yields NaN.
+
+    This is the masks-by-channels product (M @ [main, red]) / counts, but as a
+    GEMM it needs float copies of both masks and images (several times the
+    bytes of one pass), float32 accumulation, and no NaN skipping, so the
+    product is fused by hand here.
+    """
+    h, w = main.shape
+    s_all = 0.0; n_all = 0
+    s_bg = 0.0; n_bg = 0
+    s_agg = 0.0; n_agg = 0
+    s_ragg = 0.0; n_ragg = 0
+    s_rcyto = 0.0; n_rcyto = 0
+    for i in prange(h):
+        for j in range(w):
+            b = bg[i, j]
+            a = agg[i, j]
+            v = np.float64(main[i, j])
+            if np.isfinite(v):
+                s_all += v; n_all += 1
+                if b:
+                    s_bg += v; n_bg += 1
+                if a:
+                    s_agg += v; n_agg += 1
+            if a or b:
+                r = np.float64(red[i, j])
+                if np.isfinite(r):
+                    if a:
+                        s_ragg += r; n_ragg += 1
+                    elif b:
+                        s_rcyto += r; n_rcyto += 1
+    return (
+        s_all / n_all if n_all else np.nan,
+        s_bg / n_bg if n_bg else np.nan,
+        s_agg / n_agg if n_agg else np.nan,
+        s_ragg / n_ragg if n_ragg else np.nan,
+        s_rcyto / n_rcyto if n_rcyto else np.nan,
+    )
+
+# --- Fully compiled pipeline (pipeline_fast) ---
+
+@njit(cache=True)
+def _reflect(i, n):
+    # scipy.ndimage mode='reflect': (d c b a | a b c d | d c b a)
+    period = 2 * n
+    i %= period
+    return i if i < n else period - 1 - i
+
+@njit(parallel=True, fastmath=_FASTMATH, cache=True)
+def _gaussian_blur(img, sigma):
+    """Separable float32 Gaussian matching scipy's gaussian_filter (truncate=4, reflect)."""
+    h, w = img.shape
+    r = int(4.0 * sigma + 0.5)
+    x = np.arange(-r, r + 1).astype(np.float64)
+    k64 = np.exp(-0.5 * (x / sigma) ** 2)
+    k = (k64 / k64.sum()).astype(np.float32)
+    tmp = np.empty((h, w), dtype=np.float32)
+    out = np.empty((h, w), dtype=np.float32)
+    for i in prange(h):
+        for j in range(w):
+            acc = np.float32(0.0)
+            for t in range(2 * r + 1):
+                acc += k[t] * np.float32(img[i, _reflect(j + t - r, w)])
+            tmp[i, j] = acc
+    for i in prange(h):
+        for j in range(w):
+            out[i, j] = 0.0
+        for t in range(2 * r + 1):
+            src = _reflect(i + t - r, h)
+            for j in range(w):
+                out[i, j] += k[t] * tmp[src, j]
+    return out
+
+@njit(parallel=True, cache=True)
+def _dilate_square(mask, size):
+    """Binary dilation with a size x size square; outside the image counts as False."""
+    h, w = mask.shape
+    r = size // 2
+    tmp = np.empty((h, w), dtype=np.bool_)
+    out = np.empty((h, w), dtype=np.bool_)
+    for i in prange(h):
+        for j in range(w):
+            hit = False
+            for jj in range(max(j - r, 0), min(j + r + 1, w)):
+                if mask[i, jj]:
+                    hit = True
+                    break
+            tmp[i, j] = hit
+    for i in prange(h):
+        for j in range(w):
+            out[i, j] = False
+        for ii in range(max(i - r, 0), min(i + r + 1, h)):
+            for j in range(w):
+                out[i, j] |= tmp[ii, j]
+    return out
+
+@njit(cache=True)
+def _threshold(img, lower_k, upper_k):
+    h, w = img.shape
+    s, s2 = _moments(img)
+    lower, upper = _thresholds_from_moments(s, s2, h * w, lower_k, upper_k)
+    bg = np.empty((h, w), dtype=np.bool_)
+    agg = np.empty((h, w), dtype=np.bool_)
+    _fill_masks(img, lower, upper, bg, agg)
+    return bg, agg, lower, upper
+
+@njit(cache=True)
+def _masks(main, lower_k, upper_k, sigma, dilate):
+    if sigma > 0:
+        bg, agg, lower, upper = _threshold(_gaussian_blur(main, sigma), lower_k, upper_k)
+    else:
+        bg, agg, lower, upper = _threshold(main, lower_k, upper_k)
+    if dilate >= 3 and dilate % 2 == 1:
+        bg = _dilate_square(bg, dilate)
+        agg = _dilate_square(agg, dilate)
+    return bg, agg, lower, upper
+
+@njit(cache=True)
+def process_one(main, red, lower_k, upper_k, sigma, dilate):
+    """Masks + the five stage means + PC for one image pair, fully compiled.
+
+    Returns ((unedited, bg, agg, red_agg, red_cyto), pc) in the order of
+    pipeline.INTENSITY_COLUMNS.
+    """
+    bg, agg, _, _ = _masks(main, lower_k, upper_k, sigma, dilate)
+    means = _all_means(main, red, bg, agg)
+    red_agg, red_cyto = means[3], means[4]
+    pc = red_agg / red_cyto if np.isfinite(red_cyto) and red_cyto != 0 else np.nan
+    return means, pc
@@ -3,12 +3,13 @@ from __future__ import annotations
 import argparse, os, sys, pathlib
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from typing import List, Dict
+from typing import List, Dict, Optional
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 from .io import load_czi, max_projection
-from .pipeline import Settings, make_masks, measure_intensity, partition_coefficient
+from . import pipeline_fast
+from .pipeline import (INTENSITY_COLUMNS, Settings, cytoplasm_mask, make_masks, measure_intensity,
+                       partition_coefficient)
 
 STAGES = [
     "Unedited",
@@ -18,20 +19,103 @@ STAGES = [
     "RedCytoplasm",
 ]
 
+_LUTS: Dict[str, np.ndarray] = {}
+
+def _lut(name: str) -> np.ndarray:
+    """256x4 uint8 RGBA lookup table for a matplotlib colormap (cached)."""
+    lut = _LUTS.get(name)
+    if lut is None:
+        from matplotlib import colormaps
+        lut = _LUTS[name] = np.round(colormaps[name](np.linspace(0, 1, 256)) * 255).astype(np.uint8)
+    return lut
+
+def _to_uint8(img: np.ndarray, lo: float, hi: float) -> np.ndarray:
+    scale = 255.0 / (hi - lo) if hi > lo else 0.0
+    return np.nan_to_num(np.clip((img - lo) * scale, 0, 255)).astype(np.uint8)
+
 def _save_stage_png(out_dir: str, stem: str, label: str, img: np.ndarray, mask=None):
-    import matplotlib.pyplot as plt
+    """Write img in gray at native resolution, with mask pixels overlaid in magma at 50% alpha."""
+    from PIL import Image
     os.makedirs(out_dir, exist_ok=True)
-    plt.figure(figsize=(4,4))
-    if mask is None:
-        plt.imshow(img, cmap='gray')
+    gray = _to_uint8(img, np.nanmin(img), np.nanmax(img))
+    out = Image.fromarray(gray).convert("RGBA")
+    if mask is not None and mask.any():
+        vals = img[mask]
+        overlay = _lut("magma")[_to_uint8(img, np.nanmin(vals), np.nanmax(vals))]
+        overlay[..., 3] = np.where(mask, 128, 0)
+        out = Image.alpha_composite(out, Image.fromarray(overlay))
+    out.convert("RGB").save(os.path.join(out_dir, f"{stem}_{label}.png"))
+
+_PNG_POOL: Optional[ThreadPoolExecutor] = None
+_WORKER_THREADS: Optional[int] = None  # this process's share of the cores, set by _init_worker
+
+def _png_pool() -> ThreadPoolExecutor:
+    # Created lazily, so each quantify worker process gets its own
+    global _PNG_POOL
+    if _PNG_POOL is None:
+        n = _WORKER_THREADS or _cpu_count()
+        _PNG_POOL = ThreadPoolExecutor(max_workers=min(8, n))
+    return _PNG_POOL
+
+def _cpu_count() -> int:
+    """CPUs this process may run on (honours cpusets/taskset, unlike os.cpu_count)."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def _init_worker(n_threads: int):
+    # Split the cores between worker processes instead of oversubscribing them
+    global _WORKER_THREADS
+    import numba
+    # Numba refuses more threads than NUMBA_NUM_THREADS (itself capped by the affinity)
+    n_threads = max(1, min(n_threads, numba.config.NUMBA_NUM_THREADS))
+    _WORKER_THREADS = n_threads
+    numba.set_num_threads(n_threads)
+    from .pipeline import cv2
+    if cv2 is not None:
+        cv2.setNumThreads(n_threads)
+
+def _process_one(path: pathlib.Path, args, s: Settings) -> Optional[Dict]:
+    """Load one .czi, mask and measure it; return its results row (None on error)."""
+    print(f"Processing {path.name}...")
+    try:
+        # Only the two channels we measure are read: arr shape (Y,X,2)
+        arr = load_czi(str(path), channels=(args.main_channel, args.red_channel))
+    except IndexError as e:
+        print(f"ERROR: {e} ({path.name})")
+        return None
+    main_img = arr[..., 0]
+    red_img = arr[..., 1]
+
+    if args.backend == "numba" and not args.save_stages:
+        # Nothing to draw: let the compiled kernel go straight to the numbers
+        means, pc = pipeline_fast.process_one(main_img, red_img, s.lower_k, s.upper_k,
+                                              float(s.blur_sigma), int(s.dilate_size))
+        metrics = dict(zip(INTENSITY_COLUMNS, means))
     else:
-        m = np.ma.masked_where(~mask, img)
-        plt.imshow(img, cmap='gray')
-        plt.imshow(m, cmap='magma', alpha=0.5)
-    plt.axis('off')
-    plt.tight_layout()
-    plt.savefig(os.path.join(out_dir, f"{stem}_{label}.png"), dpi=200)
-    plt.close()
+        masks = (pipeline_fast.make_masks if args.backend == "numba" else make_masks)(main_img, s)
+        metrics = measure_intensity(main_img, red_img, masks)
+        pc = partition_coefficient(metrics["Red Aggregates (Intensity)"], metrics["Red Cytoplasm (Intensity)"])
+
+    row = {"Filename": path.name}
+    row.update(metrics)
+    row["PC"] = pc
+
+    if args.save_stages:
+        out_dir = str(path.parent / "qumin_output")
+        stem = path.stem
+        # Encode the five PNGs concurrently (zlib releases the GIL)
+        pool = _png_pool()
+        jobs = [pool.submit(_save_stage_png, out_dir, stem, label, img, mask) for label, img, mask in (
+            ("Unedited", main_img, None),
+            ("BackgroundRemoved", main_img, masks["bg"]),
+            ("Aggregates", main_img, masks["agg"]),
+            ("RedAggregates", red_img, masks["agg"]),
+            ("RedCytoplasm", red_img, cytoplasm_mask(masks)),
+        )]
+        for job in jobs:
+            job.result()
+    return row
 
 def cmd_quantify(args):
     directory = pathlib.Path(args.dir)
@@ -45,42 +129,43 @@ def cmd_quantify(args):
     rows = []
     out_dir = directory / "qumin_output"
     out_dir.mkdir(exist_ok=True)
-    for p in files:
-        print(f"Processing {p.name}...")
-        arr = load_czi(str(p))
-        # arr shape: (Y,X,C)
-        if args.main_channel >= arr.shape[-1] or args.red_channel >= arr.shape[-1]:
-            print(f"ERROR: channel index out of range for {p.name}. Has {arr.shape[-1]} channels.")
-            continue
-        main_img = arr[..., args.main_channel]
-        red_img = arr[..., args.red_channel]
-
-        masks = make_masks(main_img, s)
-        metrics = measure_intensity(main_img, red_img, masks)
-        pc = partition_coefficient(metrics["Red Aggregates (Intensity)"], metrics["Red Cytoplasm (Intensity)"])
-
-        row = {"Filename": p.name}
-        row.update(metrics)
-        row["PC"] = pc
-        rows.append(row)
-
-        if args.save_stages:
-            stem = p.stem
-            _save_stage_png(str(out_dir), stem, "Unedited", main_img, None)
-            _save_stage_png(str(out_dir), stem, "BackgroundRemoved", main_img, masks["bg"])
-            _save_stage_png(str(out_dir), stem, "Aggregates", main_img, masks["agg"])
-            _save_stage_png(str(out_dir), stem, "RedAggregates", red_img, masks["agg"])
-            cyto = np.logical_and(masks["bg"], ~masks["agg"])
-            _save_stage_png(str(out_dir), stem, "RedCytoplasm", red_img, cyto)
+    # Files are independent: one process each, up to --workers at a time
+    n_cpu = _cpu_count()
+    workers = min(args.workers or n_cpu, len(files))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(max(1, n_cpu // workers),)) as pool:
+        futures = [pool.submit(_process_one, p, args, s) for p in files]
+        for fut in as_completed(futures):
+            row = fut.result()
+            if row is not None:
+                rows.append(row)
+    rows.sort(key=lambda r: r["Filename"])
 
     df = pd.DataFrame(rows)
     xlsx = directory / args.xlsx
-    df.to_excel(xlsx, index=False)
+    _write_results(df, xlsx)
     print("Saved:", xlsx)
 
+def _write_results(df: pd.DataFrame, path: pathlib.Path):
+    """Write the results table; .csv paths skip Excel entirely."""
+    if path.suffix.lower() == ".csv":
+        df.to_csv(path, index=False)
+        return
+    try:
+        from rustpy_xlsxwriter import FastExcel  # optional, much faster than openpyxl
+    except ImportError:
+        df.to_excel(path, index=False, sheet_name="Results")
+        return
+    FastExcel(str(path)).sheet("Results", df).save()
+
+def _read_results(path: str) -> pd.DataFrame:
+    if path.lower().endswith(".csv"):
+        return pd.read_csv(path)
+    return pd.read_excel(path)
+
 def cmd_plot(args):
     import pandas as pd, seaborn as sns, matplotlib.pyplot as plt
-    df = pd.read_excel(args.xlsx)
+    df = _read_results(args.xlsx)
     if args.group_digits and args.group_digits > 0:
         df["Group"] = df["Filename"].str.slice(0, args.group_digits)
         x = "Group"
@@ -110,6 +195,11 @@ def _collect_stage_pngs(directory: pathlib.Path) -> Dict[str, List[pathlib.Path]
         out.setdefault(stem, []).append(p)
     return out
 
+def _read_rgb(path: pathlib.Path) -> np.ndarray:
+    from PIL import Image
+    with Image.open(path) as im:
+        return np.asarray(im.convert("RGB"))
+
 def cmd_stitch(args):
     from PIL import Image
     directory = pathlib.Path(args.dir)
@@ -120,28 +210,25 @@ def cmd_stitch(args):
     out_dir = directory / (args.out_dir or "qumin_stitched")
     out_dir.mkdir(exist_ok=True)
 
-    order = ["Unedited", "BackgroundRemoved", "Aggregates", "RedAggregates", "RedCytoplasm"]
-    for stem, files in groups.items():
-        # Map stage -> file
-        mapping = {p.stem.rsplit("_",1)[1]: p for p in files}
-        imgs = []
-        for st in order:
-            p = mapping.get(st)
-            if p is None:
+    # PNG decode/encode releases the GIL, so threads overlap the I/O
+    with ThreadPoolExecutor() as pool:
+        for stem, files in groups.items():
+            # Map stage -> file
+            mapping = {p.stem.rsplit("_",1)[1]: p for p in files}
+            paths = [mapping[st] for st in STAGES if st in mapping]
+            if not paths:
                 continue
-            imgs.append(Image.open(p).convert("RGB"))
-        if not imgs:
-            continue
-        # Make a horizontal strip
-        widths, heights = zip(*(im.size for im in imgs))
-        canvas = Image.new("RGB", (sum(widths), max(heights)), "white")
-        x = 0
-        for im in imgs:
-            canvas.paste(im, (x, 0))
-            x += im.size[0]
-        out_path = out_dir / f"stitched_{stem}.png"
-        canvas.save(out_path)
-        print("Saved:", out_path)
+            arrs = list(pool.map(_read_rgb, paths))
+            # Stages of one source share a size; pad any shorter one with white
+            height = max(a.shape[0] for a in arrs)
+            arrs = [a if a.shape[0] == height else
+                    np.pad(a, ((0, height - a.shape[0]), (0, 0), (0, 0)), constant_values=255)
+                    for a in arrs]
+            # Make a horizontal strip
+            strip = np.concatenate(arrs, axis=1)
+            out_path = out_dir / f"stitched_{stem}.png"
+            Image.fromarray(strip).save(out_path, optimize=False, compress_level=1)
+            print("Saved:", out_path)
 
 def cmd_sholl(args):
     try:
@@ -152,7 +239,7 @@ def cmd_sholl(args):
         sys.exit(1)
 
     arr = load_czi(args.file)
-    red = arr[..., args.red_channel].astype(float)
+    red = arr[..., args.red_channel]
     # simple mask from lower-k on red
     from .pipeline import compute_thresholds, Settings, make_masks
     s = Settings(lower_k=args.lower_k, upper_k=999, blur_sigma=args.blur, dilate_size=args.dilate)
@@ -169,6 +256,12 @@ def cmd_sholl(args):
     df.to_csv(out, index=False)
     print("Saved:", out)
 
+def _non_negative_int(value: str) -> int:
+    n = int(value)
+    if n < 0:
+        raise argparse.ArgumentTypeError(f"must be >= 0, got {n}")
+    return n
+
 def build_parser():
     p = argparse.ArgumentParser(prog="qumin", description="CZI → masks → metrics → figures")
     sub = p.add_subparsers(dest="cmd", required=True)
@@ -182,7 +275,11 @@ def build_parser():
     q.add_argument("--blur", type=float, default=0.0, help="Gaussian sigma; 0 disables")
     q.add_argument("--dilate", type=int, default=0, help="Dilation kernel size (odd int); 0 disables")
     q.add_argument("--save-stages", action="store_true")
-    q.add_argument("--xlsx", default="Results.xlsx")
+    q.add_argument("--backend", choices=["standard", "numba"], default="standard",
+                   help="standard: OpenCV (or scipy/skimage) blur and dilation with Numba reductions; "
+                        "numba: every step compiled in one call")
+    q.add_argument("--workers", type=_non_negative_int, default=0, help="Parallel worker processes; 0 uses all CPUs")
+    q.add_argument("--xlsx", default="Results.xlsx", help="Output table (.xlsx, or .csv for plain text)")
     q.set_defaults(func=cmd_quantify)
 
     b = sub.add_parser("plot", help="Make a boxplot from Results.xlsx")
@@ -1,56 +1,95 @@
 
 from __future__ import annotations
 import numpy as np
-from typing import Tuple
+from typing import Optional, Sequence, Tuple
 import czifile
 
-def load_czi(path: str) -> np.ndarray:
-    """Load a CZI file as a numpy array with channels last (Y,X,C) if possible.
-    Strategy: read with czifile.imread; squeeze singleton dims; if dims > 3,
-    we max-project across non-channel dims. Tries axes ordering heuristics.
+def _channel_axis(axes: str, shape: Sequence[int]) -> int:
+    """Index of the axis holding channels, or -1 if the data has a single channel.
+
+    That is C, unless C is missing or of size 1 while the samples axis '0' is
+    larger (RGB/Bgr24 data), in which case the colour samples are the channels.
     """
-    arr = czifile.imread(path)
-    arr = np.asarray(arr)
-    # move channel axis to last if we can guess it
-    # Heuristic: the smallest dim among last 4 is often C; but we avoid fantasy—
-    # we check for dims <= 5 and assume C <= 5.
-    axes = arr.shape
-    # Flatten singleton dims
-    while arr.ndim > 3:
-        # Project over the first non-channel axis
-        # We'll assume channel index is the last dim with size <= 5
-        chan_idx = None
-        for i, sz in enumerate(arr.shape[::-1]):
-            if sz <= 5:
-                chan_idx = arr.ndim - 1 - i
-                break
-        if chan_idx is None:
-            # Fallback: assume last dim is channels if small; else project last axis
-            chan_idx = arr.ndim - 1 if arr.shape[-1] <= 5 else None
-        if arr.ndim == 4:
-            # choose a projection axis that's not channel
-            axes_order = list(range(arr.ndim))
-            proj_axis = 0 if chan_idx != 0 else 1
-            arr = arr.max(axis=proj_axis)
-        else:
-            # nd>4: project the first axis
-            arr = arr.max(axis=0)
-    # At this point arr should be (Y,X) or (Y,X,C) or (C,Y,X)
-    if arr.ndim == 2:
+    ic, i0 = axes.find("C"), axes.find("0")
+    if ic >= 0 and shape[ic] > 1:
+        return ic
+    if i0 >= 0 and shape[i0] > 1:
+        return i0
+    return ic
+
+def _project_to_yxc(arr: np.ndarray, axes: str) -> np.ndarray:
+    """Max-project every axis but Y/X/channels in one reduction, returning (Y,X,C)."""
+    iy, ix, ic = axes.index("Y"), axes.index("X"), _channel_axis(axes, arr.shape)
+    keep = (iy, ix, ic) if ic >= 0 else (iy, ix)
+    reduce_axes = tuple(i for i in range(arr.ndim) if i not in keep)
+    if reduce_axes:
+        arr = arr.max(axis=reduce_axes)
+    # Remaining axes keep their file order; put them in (Y,X,C) order
+    kept = sorted(keep)
+    arr = np.transpose(arr, [kept.index(i) for i in keep])
+    if ic < 0:
         # single-channel
-        arr = np.stack([arr], axis=-1)
-    elif arr.shape[0] <= 5 and arr.ndim == 3:
-        # (C,Y,X) -> (Y,X,C)
-        arr = np.moveaxis(arr, 0, -1)
-    return arr.astype(float)
+        arr = arr[..., np.newaxis]
+    return arr
+
+def _read_channels(cz: czifile.CziFile, channels: Sequence[int]) -> np.ndarray:
+    """Max-project only the subblocks of the requested channels into (Y,X,len(channels)).
+
+    Subblocks of other channels are never read or decompressed; every axis
+    other than Y/X and the channel axis (Z, T, S, ...) is collapsed by max as
+    tiles arrive. The channel axis is chosen as in load_czi (RGB samples count).
+    """
+    axes = cz.axes
+    iy, ix, ich = axes.index("Y"), axes.index("X"), _channel_axis(axes, cz.shape)
+    n_chan = cz.shape[ich] if ich >= 0 else 1
+    for c in channels:
+        if not 0 <= c < n_chan:
+            raise IndexError(f"channel {c} out of range; file has {n_chan} channels")
+    # Colour samples live inside every subblock; C is one subblock per channel
+    per_sample = ich >= 0 and axes[ich] == "0"
+    out = np.zeros((cz.shape[iy], cz.shape[ix], len(channels)), dtype=cz.dtype)
+    for entry in cz.filtered_subblock_directory:
+        if per_sample:
+            wanted = list(enumerate(channels))
+        else:
+            c = entry.start[ich] - cz.start[ich] if ich >= 0 else 0
+            wanted = [(k, 0) for k, ch in enumerate(channels) if ch == c]
+        if not wanted:
+            continue
+        tile = entry.data_segment().data()
+        others = tuple(i for i in range(tile.ndim) if i not in (iy, ix))
+        y0 = entry.start[iy] - cz.start[iy]
+        x0 = entry.start[ix] - cz.start[ix]
+        for k, idx in wanted:
+            sub = np.take(tile, [idx], axis=ich) if ich >= 0 else tile
+            plane = sub.max(axis=others)
+            view = out[y0:y0 + plane.shape[0], x0:x0 + plane.shape[1], k]
+            np.maximum(view, plane[:view.shape[0], :view.shape[1]], out=view)
+    return out
+
+def load_czi(path: str, channels: Optional[Sequence[int]] = None) -> np.ndarray:
+    """Load a CZI file as a float32 numpy array with channels last (Y,X,C).
+    Axes come from the file's own metadata (e.g. 'STCZYX0'): everything except
+    Y, X and the channel axis (Z, T, S, ...) is max-projected. RGB files with no
+    real C axis use their colour samples as channels.
+
+    If ``channels`` is given, only those channel planes are read and the result
+    is (Y,X,len(channels)) in that order; raises IndexError for a missing channel.
+    """
+    with czifile.CziFile(path) as cz:
+        if channels is not None:
+            return _read_channels(cz, channels).astype(np.float32, copy=False)
+        axes = cz.axes
+        arr = cz.asarray()
+    return _project_to_yxc(arr, axes).astype(np.float32, copy=False)
 
 def max_projection(arr: np.ndarray) -> np.ndarray:
-    """Ensure array is (Y,X,C) float; if extra dims linger, max-project them."""
-    a = np.asarray(arr, dtype=float)
+    """Ensure array is (Y,X,C) float32; if extra dims linger, max-project them."""
+    a = np.asarray(arr, dtype=np.float32)
     while a.ndim > 3:
         a = a.max(axis=0)
     if a.ndim == 2:
-        a = np.stack([a], axis=-1)
-    if a.shape[0] <= 5 and a.ndim == 3:
+        a = a[..., np.newaxis]
+    elif a.shape[0] <= 5 and a.ndim == 3:
         a = np.moveaxis(a, 0, -1)
     return a
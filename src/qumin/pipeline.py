@@ -4,7 +4,12 @@ import numpy as np
 from dataclasses import dataclass
 from typing import Dict, Tuple, Optional
 from scipy.ndimage import gaussian_filter, binary_dilation
-from skimage import morphology
+try:
+    import cv2  # optional: faster blur and dilation
+except ImportError:
+    cv2 = None
+
+from ._kernels import _all_means, _moments, _thresh_and_mask, _thresholds_from_moments
 
 @dataclass
 class Settings:
@@ -13,63 +18,101 @@ class Settings:
     blur_sigma: float = 0.0  # in pixels; 0 disables
     dilate_size: int = 0     # odd integer kernel; 0 disables
 
+def _as_2d(a: np.ndarray) -> np.ndarray:
+    """Reshape to 2-D for the row-wise kernels (a view when the layout allows)."""
+    if a.ndim == 2:
+        return a
+    if a.ndim < 2:
+        return a.reshape(1, -1)
+    return a.reshape(-1, a.shape[-1])
+
 def compute_thresholds(image: np.ndarray, lower_k: float, upper_k: float) -> Tuple[float, float]:
-    """Return (lower_threshold, upper_threshold) as mean + k*std."""
-    img = image.astype(float)
-    std = img.std()
-    mean = img.mean()
-    lower = mean + lower_k * std
-    upper = mean + upper_k * std
+    """Return (lower_threshold, upper_threshold) as mean + k*std over all pixels (any shape)."""
+    img = _as_2d(np.asarray(image))
+    s, s2 = _moments(img)
+    lower, upper = _thresholds_from_moments(s, s2, img.size, lower_k, upper_k)
     return float(lower), float(upper)
 
 def _prep(image: np.ndarray, s: Settings) -> np.ndarray:
-    img = image.astype(float)
+    """Blur in float32 if requested; otherwise keep the native dtype (no copy)."""
+    img = np.asarray(image)
     if s.blur_sigma and s.blur_sigma > 0:
-        img = gaussian_filter(img, sigma=s.blur_sigma)
+        img = np.ascontiguousarray(img, dtype=np.float32)
+        if cv2 is not None and img.ndim == 2:
+            # BORDER_REFLECT matches scipy's default mode='reflect'
+            img = cv2.GaussianBlur(img, (0, 0), sigmaX=s.blur_sigma, sigmaY=s.blur_sigma,
+                                   borderType=cv2.BORDER_REFLECT)
+        else:
+            img = gaussian_filter(img, sigma=s.blur_sigma)
     return img
 
+def _dilate(mask: np.ndarray, size: int) -> np.ndarray:
+    """Binary dilation of a bool mask with a size x size square."""
+    if cv2 is not None:
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (size, size))
+        out = cv2.dilate(mask.view(np.uint8), kernel, iterations=1,
+                         borderType=cv2.BORDER_CONSTANT, borderValue=0)
+        return out.view(bool)
+    return binary_dilation(mask, np.ones((size, size), dtype=bool))
+
 def make_masks(main_channel_img: np.ndarray, s: Settings) -> Dict[str, np.ndarray]:
     """Create background-removed and aggregates masks.
-    Returns a dict with keys: 'bg', 'agg' (boolean masks).
+    Returns a dict with keys: 'bg', 'agg' (boolean masks, same shape as the image).
+    Any shape is thresholded; dilation needs a 2-D (Y,X) image.
     """
+    dilate = bool(s.dilate_size and s.dilate_size >= 3 and s.dilate_size % 2 == 1)
+    if dilate and np.ndim(main_channel_img) != 2:
+        raise ValueError(f"dilation expects a 2-D (Y,X) image, got shape {np.shape(main_channel_img)}")
     img = _prep(main_channel_img, s)
-    lower, upper = compute_thresholds(img, s.lower_k, s.upper_k)
-    bg = img > lower
-    agg = img > upper
-    if s.dilate_size and s.dilate_size >= 3 and s.dilate_size % 2 == 1:
-        selem = morphology.square(s.dilate_size)
-        bg = morphology.binary_dilation(bg, selem)
-        agg = morphology.binary_dilation(agg, selem)
-    return {"bg": bg.astype(bool), "agg": agg.astype(bool), "lower": lower, "upper": upper}
+    flat = _as_2d(img)
+    bg = np.empty(flat.shape, dtype=np.bool_)
+    agg = np.empty(flat.shape, dtype=np.bool_)
+    lower, upper = _thresh_and_mask(flat, s.lower_k, s.upper_k, bg, agg)
+    bg = bg.reshape(img.shape)
+    agg = agg.reshape(img.shape)
+    if dilate:
+        bg = _dilate(bg, s.dilate_size)
+        agg = _dilate(agg, s.dilate_size)
+    return {"bg": bg, "agg": agg, "lower": lower, "upper": upper}
 
-def _nonzero_mean(values: np.ndarray, mask: Optional[np.ndarray]) -> float:
-    if mask is None:
-        v = values
-    else:
-        v = values[mask]
-    v = v[np.isfinite(v)]
-    if v.size == 0:
-        return float('nan')
-    return float(v.mean())
+def cytoplasm_mask(masks: Dict[str, np.ndarray], out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Cytoplasm = bg & ~agg, built in a single buffer (``out`` if given)."""
+    out = np.logical_not(masks["agg"], out=out)
+    return np.logical_and(masks["bg"], out, out=out)
+
+def mask_bbox(mask: np.ndarray) -> np.ndarray:
+    """Half-open bounding box (y0, y1, x0, x1) of the True pixels of a mask.
+
+    Accepts one (H,W) mask or a batch (..., H, W) and returns ints of shape
+    (..., 4) without a per-mask Python loop; empty masks give (0, 0, 0, 0).
+    """
+    mask = np.asarray(mask, dtype=bool)
+    rows = mask.any(axis=-1)
+    cols = mask.any(axis=-2)
+    y0 = rows.argmax(axis=-1)
+    y1 = rows.shape[-1] - rows[..., ::-1].argmax(axis=-1)
+    x0 = cols.argmax(axis=-1)
+    x1 = cols.shape[-1] - cols[..., ::-1].argmax(axis=-1)
+    box = np.stack([y0, y1, x0, x1], axis=-1)
+    box[~rows.any(axis=-1)] = 0
+    return box
+
+INTENSITY_COLUMNS = (
+    "Unedited (Intensity)",
+    "Background Removed (Intensity)",
+    "Aggregates (Intensity)",
+    "Red Aggregates (Intensity)",
+    "Red Cytoplasm (Intensity)",
+)
 
 def measure_intensity(main_img: np.ndarray, red_img: np.ndarray, masks: Dict[str, np.ndarray]) -> Dict[str, float]:
-    """Compute mean intensities for stages and PC."""
-    bg = masks["bg"]; agg = masks["agg"]
-    # Stages on main channel
-    unedited = _nonzero_mean(main_img, None)
-    bg_mean = _nonzero_mean(main_img, bg)
-    agg_mean = _nonzero_mean(main_img, agg)
-    # Red channel on regions
-    red_agg = _nonzero_mean(red_img, agg)
-    cytoplasm_mask = np.logical_and(bg, ~agg)
-    red_cyto = _nonzero_mean(red_img, cytoplasm_mask)
-    return {
-        "Unedited (Intensity)": unedited,
-        "Background Removed (Intensity)": bg_mean,
-        "Aggregates (Intensity)": agg_mean,
-        "Red Aggregates (Intensity)": red_agg,
-        "Red Cytoplasm (Intensity)": red_cyto,
-    }
+    """Compute mean intensities for stages and PC.
+    Images and masks may have any shape, but it must be the same for all four.
+    """
+    arrays = [np.asarray(a) for a in (main_img, red_img, masks["bg"], masks["agg"])]
+    if len({a.shape for a in arrays}) != 1:
+        raise ValueError(f"images and masks must share one shape, got {[a.shape for a in arrays]}")
+    return dict(zip(INTENSITY_COLUMNS, _all_means(*(_as_2d(a) for a in arrays))))
 
 def partition_coefficient(red_agg: float, red_cyto: float) -> float:
     if red_cyto is None or not np.isfinite(red_cyto) or red_cyto == 0:
@@ -0,0 +1,18 @@
+
+from __future__ import annotations
+import numpy as np
+from typing import Dict
+
+from ._kernels import _masks, process_one
+from .pipeline import Settings
+
+# Numba-only counterpart of pipeline.make_masks/measure_intensity: blur,
+# threshold, dilation and the fused means all run as compiled kernels (in
+# _kernels, cached on disk). pipeline.py is the standard backend, with
+# OpenCV or scipy/skimage doing the blur and dilation.
+
+def make_masks(main_channel_img: np.ndarray, s: Settings) -> Dict[str, np.ndarray]:
+    """Numba version of pipeline.make_masks (same keys)."""
+    bg, agg, lower, upper = _masks(main_channel_img, s.lower_k, s.upper_k,
+                                   float(s.blur_sigma or 0.0), int(s.dilate_size or 0))
+    return {"bg": bg, "agg": agg, "lower": lower, "upper": upper}
@@ -0,0 +1,113 @@
+import threading
+import time
+import numpy as np
+import pytest
+from qumin.cli import build_parser
+
+def test_workers_must_be_non_negative():
+    p = build_parser()
+    args = ["quantify", "--main-channel", "0", "--red-channel", "1"]
+    assert p.parse_args(args + ["--workers", "2"]).workers == 2
+    with pytest.raises(SystemExit):
+        p.parse_args(args + ["--workers", "-1"])
+
+def test_png_pool_uses_worker_share(monkeypatch):
+    import numba
+    import qumin.cli as cli
+    from qumin.pipeline import cv2
+    monkeypatch.setattr(cli, "_PNG_POOL", None)
+    monkeypatch.setattr(cli, "_WORKER_THREADS", None)
+    monkeypatch.setattr(numba, "set_num_threads", lambda n: None)
+    if cv2 is not None:
+        monkeypatch.setattr(cv2, "setNumThreads", lambda n: None)
+    cli._init_worker(1)
+    assert cli._WORKER_THREADS == 1
+    pool = cli._png_pool()
+    try:
+        idents = list(pool.map(lambda _: (time.sleep(0.01), threading.get_ident())[1], range(8)))
+    finally:
+        pool.shutdown()
+    assert len(set(idents)) == 1
+
+def test_save_stage_png_gray_and_overlay(tmp_path):
+    from PIL import Image
+    from qumin.cli import _lut, _save_stage_png
+    img = np.array([[0.0, 1.0, 2.0, 3.0],
+                    [4.0, 5.0, 6.0, np.nan]])
+    mask = np.zeros(img.shape, bool)
+    mask[1, :2] = True
+    _save_stage_png(str(tmp_path), "s", "Stage", img, mask)
+    out = Image.open(tmp_path / "s_Stage.png")
+
+    assert out.size == (4, 2) and out.mode == "RGB"
+    px = np.asarray(out).astype(int)
+    # Unmasked pixels: gray, min/max normalised over finite values; NaN -> black
+    assert px[0, 0].tolist() == [0, 0, 0]
+    assert px[0, 3].tolist() == [127, 127, 127]
+    assert px[1, 3].tolist() == [0, 0, 0]
+    # Masked pixels: magma normalised over the masked values, blended at 50%
+    magma = _lut("magma").astype(int)
+    for (y, x), idx in (((1, 0), 0), ((1, 1), 255)):
+        gray = round(img[y, x] / 6.0 * 255)
+        expected = (magma[idx, :3] + gray) / 2
+        assert np.abs(px[y, x] - expected).max() <= 2
+
+@pytest.mark.parametrize("name, writer", [
+    ("Results.csv", None),
+    ("Results.xlsx", "rustpy_xlsxwriter"),
+    ("Results.xlsx", "openpyxl"),
+])
+def test_results_round_trip(tmp_path, monkeypatch, name, writer):
+    import sys
+    import pandas as pd
+    from qumin.cli import _read_results, _write_results
+    if writer == "rustpy_xlsxwriter":
+        pytest.importorskip("rustpy_xlsxwriter")
+    elif writer == "openpyxl":
+        monkeypatch.setitem(sys.modules, "rustpy_xlsxwriter", None)  # force the fallback
+    df = pd.DataFrame({"Filename": ["a.czi", "b.czi"],
+                       "Red Aggregates (Intensity)": [2.5, 3.0],
+                       "PC": [1.25, np.nan]})
+    path = tmp_path / name
+    _write_results(df, path)
+    back = _read_results(str(path))
+
+    assert back["Filename"].tolist() == ["a.czi", "b.czi"]
+    assert np.allclose(back["Red Aggregates (Intensity)"], [2.5, 3.0])
+    assert back["PC"].iloc[0] == 1.25 and np.isnan(back["PC"].iloc[1])
+
+def test_init_worker_clamps_to_numba_limit(monkeypatch):
+    import numba
+    import qumin.cli as cli
+    from qumin.pipeline import cv2
+    monkeypatch.setattr(cli, "_WORKER_THREADS", None)
+    limit = numba.config.NUMBA_NUM_THREADS
+    before = numba.get_num_threads()
+    cv2_before = cv2.getNumThreads() if cv2 is not None else None
+    try:
+        cli._init_worker(limit + 3)
+        assert cli._WORKER_THREADS == limit
+        assert numba.get_num_threads() == limit
+    finally:
+        numba.set_num_threads(before)
+        if cv2 is not None:
+            cv2.setNumThreads(cv2_before)
+
+def test_stitch_orders_stages_and_pads(tmp_path):
+    from argparse import Namespace
+    from PIL import Image
+    from qumin.cli import STAGES, cmd_stitch
+    out = tmp_path / "qumin_output"
+    out.mkdir()
+    # Written in reverse stage order, the later stage taller than the earlier one
+    tall = np.full((6, 4, 3), (10, 20, 30), np.uint8)
+    short = np.full((3, 5, 3), (40, 50, 60), np.uint8)
+    Image.fromarray(tall).save(out / f"img_{STAGES[2]}.png")
+    Image.fromarray(short).save(out / f"img_{STAGES[0]}.png")
+    cmd_stitch(Namespace(dir=str(tmp_path), out_dir=None))
+    strip = np.asarray(Image.open(tmp_path / "qumin_stitched" / "stitched_img.png").convert("RGB"))
+
+    assert strip.shape == (6, 9, 3)
+    assert np.array_equal(strip[:3, :5], short)
+    assert np.all(strip[3:, :5] == 255)
+    assert np.array_equal(strip[:, 5:], tall)
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from types import SimpleNamespace
+from qumin.io import _read_channels
+
+def _fake_czi(vol, axes="TCZYX0"):
+    """Stand-in for czifile.CziFile: one subblock per (T,C,Z) plane, two tiles along X."""
+    start = (0, 0, 0, 5, 7, 0)
+    entries = []
+    T, C, Z, Y, X, _ = vol.shape
+    for t in range(T):
+        for c in range(C):
+            for z in range(Z):
+                for x0, x1 in ((0, X // 2), (X // 2, X)):
+                    tile = vol[t:t+1, c:c+1, z:z+1, :, x0:x1, :]
+                    seg = SimpleNamespace(data=lambda tile=tile: tile)
+                    entries.append(SimpleNamespace(
+                        start=(t, c, z, start[3], start[4] + x0, 0),
+                        data_segment=lambda seg=seg: seg,
+                    ))
+    return SimpleNamespace(axes=axes, shape=vol.shape, start=start, dtype=vol.dtype,
+                           filtered_subblock_directory=entries)
+
+def test_read_channels_max_projects_selected():
+    rng = np.random.default_rng(0)
+    vol = (rng.random((2, 3, 4, 20, 30, 1)) * 4000).astype(np.uint16)
+    out = _read_channels(_fake_czi(vol), (2, 0))
+    ref = vol.max(axis=(0, 2, 5))  # (C,Y,X)
+
+    assert out.shape == (20, 30, 2)
+    assert np.array_equal(out[..., 0], ref[2])
+    assert np.array_equal(out[..., 1], ref[0])
+
+def test_read_channels_out_of_range():
+    vol = np.zeros((1, 2, 1, 4, 4, 1), np.uint16)
+    with pytest.raises(IndexError):
+        _read_channels(_fake_czi(vol), (0, 2))
+
+def test_read_channels_rgb_samples():
+    rng = np.random.default_rng(3)
+    rgb = (rng.random((1, 6, 7, 3)) * 255).astype(np.uint8)
+    seg = SimpleNamespace(data=lambda: rgb)
+    cz = SimpleNamespace(axes="CYX0", shape=rgb.shape, start=(0, 0, 0, 0), dtype=rgb.dtype,
+                         filtered_subblock_directory=[SimpleNamespace(start=(0, 0, 0, 0),
+                                                                      data_segment=lambda: seg)])
+    out = _read_channels(cz, (0, 1))
+
+    assert np.array_equal(out, rgb[0, :, :, :2])
+
+def test_project_to_yxc():
+    from qumin.io import _project_to_yxc
+    rng = np.random.default_rng(1)
+    vol = rng.random((2, 3, 4, 5, 6, 1))
+    out = _project_to_yxc(vol, "TCZYX0")
+
+    assert out.shape == (5, 6, 3)
+    assert np.array_equal(out, np.moveaxis(vol.max(axis=(0, 2, 5)), 0, -1))
+
+def test_project_to_yxc_rgb_samples_are_channels():
+    from qumin.io import _project_to_yxc
+    rng = np.random.default_rng(2)
+    rgb = rng.random((2, 1, 5, 6, 3))
+    out = _project_to_yxc(rgb, "BCYX0")
+
+    assert out.shape == (5, 6, 3)
+    assert np.array_equal(out, rgb.max(axis=(0, 1)))
+
+def test_max_projection_adds_channel_axis_without_copy():
+    from qumin.io import max_projection
+    img = np.arange(12, dtype=np.float32).reshape(3, 4)
+    out = max_projection(img)
+
+    assert out.shape == (3, 4, 1)
+    assert np.shares_memory(out, img)
@@ -0,0 +1,25 @@
+import numpy as np
+from qumin import pipeline_fast
+from qumin.pipeline import Settings, make_masks, measure_intensity, partition_coefficient
+
+def _images():
+    rng = np.random.default_rng(0)
+    arr = (rng.random((48, 37, 2)) * 4000).astype(np.float32)
+    return arr[..., 0], arr[..., 1]
+
+def test_fast_masks_match_reference():
+    main, _ = _images()
+    for s in (Settings(0.1, 1.0), Settings(0.1, 1.0, blur_sigma=1.5, dilate_size=3)):
+        fast = pipeline_fast.make_masks(main, s)
+        ref = make_masks(main, s)
+        assert np.array_equal(fast["bg"], ref["bg"])
+        assert np.array_equal(fast["agg"], ref["agg"])
+
+def test_process_one_matches_reference():
+    main, red = _images()
+    s = Settings(lower_k=0.1, upper_k=0.8, blur_sigma=1.0, dilate_size=3)
+    means, pc = pipeline_fast.process_one(main, red, s.lower_k, s.upper_k, s.blur_sigma, s.dilate_size)
+    m = measure_intensity(main, red, make_masks(main, s))
+
+    assert np.allclose(means, list(m.values()))
+    assert np.isclose(pc, partition_coefficient(m["Red Aggregates (Intensity)"], m["Red Cytoplasm (Intensity)"]))
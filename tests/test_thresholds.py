@@ -1,5 +1,6 @@
 
 import numpy as np
+import pytest
 from qumin.pipeline import compute_thresholds, make_masks, Settings, measure_intensity, partition_coefficient
 
 def test_threshold_order():
@@ -21,3 +22,125 @@ def test_masks_and_metrics():
     assert m["Aggregates (Intensity)"] >= m["Background Removed (Intensity)"]
     pc = partition_coefficient(m["Red Aggregates (Intensity)"], m["Red Cytoplasm (Intensity)"])
     assert np.isnan(pc) or pc >= 0.0
+
+def test_masks_match_thresholds():
+    rng = np.random.default_rng(0)
+    img = rng.random((37, 53)) * 100.0
+    s = Settings(lower_k=0.25, upper_k=0.5, blur_sigma=0, dilate_size=0)
+    masks = make_masks(img, s)
+    lower, upper = compute_thresholds(img, s.lower_k, s.upper_k)
+
+    assert np.isclose(masks["lower"], lower) and np.isclose(masks["upper"], upper)
+    assert np.array_equal(masks["bg"], img > lower)
+    assert np.array_equal(masks["agg"], img > upper)
+
+def test_measure_intensity_matches_masked_means():
+    rng = np.random.default_rng(1)
+    main = rng.random((40, 30)) * 10.0
+    red = rng.random((40, 30)) * 10.0
+    red[0, :] = np.nan
+    masks = make_masks(main, Settings(lower_k=0.0, upper_k=1.0))
+    bg, agg = masks["bg"], masks["agg"]
+    m = measure_intensity(main, red, masks)
+
+    def ref(v):
+        v = v[np.isfinite(v)]
+        return v.mean()
+
+    assert np.isclose(m["Unedited (Intensity)"], main.mean())
+    assert np.isclose(m["Background Removed (Intensity)"], main[bg].mean())
+    assert np.isclose(m["Aggregates (Intensity)"], main[agg].mean())
+    assert np.isclose(m["Red Aggregates (Intensity)"], ref(red[agg]))
+    assert np.isclose(m["Red Cytoplasm (Intensity)"], ref(red[bg & ~agg]))
+
+def test_uint16_masks_match_float():
+    rng = np.random.default_rng(2)
+    img = (rng.random((25, 40)) * 4000).astype(np.uint16)
+    s = Settings(lower_k=0.25, upper_k=0.5)
+    masks = make_masks(img, s)
+    ref = make_masks(img.astype(np.float64), s)
+
+    assert np.array_equal(masks["bg"], ref["bg"])
+    assert np.array_equal(masks["agg"], ref["agg"])
+
+@pytest.mark.parametrize("no_cv2", [False, True])
+def test_blur_matches_scipy(monkeypatch, no_cv2):
+    from scipy.ndimage import gaussian_filter
+    from qumin import pipeline
+    from qumin.pipeline import _prep
+    if no_cv2:
+        monkeypatch.setattr(pipeline, "cv2", None)
+    rng = np.random.default_rng(3)
+    img = rng.random((30, 45)) * 100.0
+    out = _prep(img, Settings(blur_sigma=1.5))
+
+    assert out.dtype == np.float32
+    assert np.allclose(out, gaussian_filter(img, sigma=1.5), atol=1e-3)
+
+@pytest.mark.parametrize("no_cv2", [False, True])
+def test_dilate_matches_square_footprint(monkeypatch, no_cv2):
+    from scipy.ndimage import binary_dilation
+    from qumin import pipeline
+    from qumin.pipeline import _dilate
+    if no_cv2:
+        monkeypatch.setattr(pipeline, "cv2", None)
+    rng = np.random.default_rng(4)
+    mask = rng.random((30, 41)) > 0.97
+    mask[0, 0] = mask[-1, -1] = True
+    out = _dilate(mask, 5)
+
+    assert out.dtype == bool
+    assert np.array_equal(out, binary_dilation(mask, structure=np.ones((5, 5), bool)))
+
+def test_cytoplasm_mask():
+    from qumin.pipeline import cytoplasm_mask
+    bg = np.array([[True, True], [False, True]])
+    agg = np.array([[False, True], [False, False]])
+    buf = np.empty_like(bg)
+    out = cytoplasm_mask({"bg": bg, "agg": agg}, out=buf)
+
+    assert out is buf
+    assert np.array_equal(out, bg & ~agg)
+
+def test_mask_bbox():
+    from qumin.pipeline import mask_bbox
+    masks = np.zeros((3, 8, 10), bool)
+    masks[0, 2:5, 3:7] = True
+    masks[1, 7, 0] = True
+
+    assert mask_bbox(masks[0]).tolist() == [2, 5, 3, 7]
+    assert mask_bbox(masks).tolist() == [[2, 5, 3, 7], [7, 8, 0, 1], [0, 0, 0, 0]]
+
+def test_make_masks_any_shape_without_dilation():
+    rng = np.random.default_rng(6)
+    img = rng.random((3, 12, 15))
+    s = Settings(lower_k=0.25, upper_k=0.5)
+    masks = make_masks(img, s)
+    lower, upper = compute_thresholds(img, s.lower_k, s.upper_k)
+
+    assert masks["bg"].shape == img.shape
+    assert np.array_equal(masks["bg"], img > lower)
+    assert np.array_equal(masks["agg"], img > upper)
+    assert make_masks(img[0, 0], s)["bg"].shape == (15,)
+    with pytest.raises(ValueError):
+        make_masks(img, Settings(dilate_size=3))
+
+def test_thresholds_accept_any_shape():
+    rng = np.random.default_rng(5)
+    for shape in ((100,), (4, 10, 10)):
+        img = rng.random(shape)
+        lower, upper = compute_thresholds(img, 0.25, 0.5)
+        assert np.isclose(lower, img.mean() + 0.25 * img.std())
+        assert np.isclose(upper, img.mean() + 0.5 * img.std())
+
+def test_measure_intensity_nd_and_shape_check():
+    rng = np.random.default_rng(6)
+    main = rng.random((3, 8, 9))
+    bg = main > 0.2
+    agg = main > 0.7
+    m = measure_intensity(main, main, {"bg": bg, "agg": agg})
+
+    assert np.isclose(m["Background Removed (Intensity)"], main[bg].mean())
+    assert np.isclose(m["Red Cytoplasm (Intensity)"], main[bg & ~agg].mean())
+    with pytest.raises(ValueError):
+        measure_intensity(main, main[0], {"bg": bg, "agg": agg})